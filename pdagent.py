@@ -1,10 +1,12 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from io import BytesIO
 from datetime import datetime
+import hashlib
 import os
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Set page configuration
 st.set_page_config(page_title="PREDICTIVE SUMMARIZER", page_icon="📊")
@@ -20,176 +22,219 @@ uploaded_files = st.file_uploader(
     type=['xlsx', 'xls']
 )
 
-# Create a directory to store uploaded files temporarily
-UPLOAD_DIR = "uploads"
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
+# Maximum number of workbooks parsed concurrently
+MAX_READ_WORKERS = 8
 
-# Function to convert time to seconds
-def time_to_seconds(time_val):
+# Maximum number of merged upload sets kept in memory across all sessions
+MAX_CACHED_MERGES = 8
+
+# Create a directory to keep parsed workbooks as Parquet, keyed by content digest
+CACHE_DIR = "cache"
+MAX_CACHED_FILES = 64
+if not os.path.exists(CACHE_DIR):
+    os.makedirs(CACHE_DIR)
+
+# Time columns to convert and sum
+TIME_COLUMNS = [
+    'Spent Time', 'Talk Time', 'AVG Talk Time', 'Wait Time',
+    'Average Wait Time', 'Write Time', 'AVG Write Time', 'Pause Time'
+]
+
+# Columns never used downstream; read_excel skips them entirely
+DROPPED_COLUMNS = {'SNo.', 'Total Calls', 'Pause Count'}
+
+# Known columns are read as strings so pandas skips type inference on them
+COLUMN_DTYPES = {'Collector Name': 'string[pyarrow]', **{col: 'string' for col in TIME_COLUMNS}}
+
+# Excel engine, and a short hash of the read options that is part of every Parquet cache
+# filename so changing the engine, dtypes or dropped columns never serves stale frames
+READ_ENGINE = "calamine"
+PARSE_VERSION = hashlib.sha1(
+    repr((READ_ENGINE, sorted(COLUMN_DTYPES.items()), sorted(DROPPED_COLUMNS))).encode()
+).hexdigest()[:8]
+
+# Pattern for HH:MM:SS or MM:SS time strings, and the seconds per captured part
+TIME_PATTERN = r"^\s*(?:([-+]?\d+)\s*:\s*)?([-+]?\d+)\s*:\s*([-+]?\d+)\s*$"
+TIME_WEIGHTS = np.array([3600, 60, 1])
+
+# Function to convert a column of time values to seconds
+def time_to_seconds(series):
+    # Numeric values are already seconds; plain float64 so fractional fills below can't hit an Int64 result
+    seconds = pd.to_numeric(series, errors='coerce').astype('float64')
+    
+    # Parse the remaining values as HH:MM:SS or MM:SS
+    text = series.where(seconds.isna()).astype('string')
+    parts = text.str.extract(TIME_PATTERN).to_numpy(dtype='float64', na_value=np.nan)
+    parts[:, 0] = np.nan_to_num(parts[:, 0])  # MM:SS has no hours
+    parsed = pd.Series(parts @ TIME_WEIGHTS, index=series.index)
+    
+    # Duration cells ([h]:mm:ss, as in our own download) arrive as Timedelta strings
+    # such as "1 days 06:00:00"; anything still unparsed after that becomes 0
+    durations = pd.to_timedelta(text.where(parsed.isna()), errors='coerce').dt.total_seconds()
+    
+    return seconds.fillna(parsed).fillna(durations).fillna(0)
+
+# Function to format a column of seconds to [h]:mm:ss for display
+def seconds_to_time(series):
+    seconds = np.nan_to_num(series.to_numpy(dtype='float64')).astype(np.int64)
+    hours, remainder = np.divmod(seconds, 3600)
+    minutes, seconds = np.divmod(remainder, 60)
+    return pd.Series(
+        [f"{h}:{m:02d}:{s:02d}" for h, m, s in zip(hours.tolist(), minutes.tolist(), seconds.tolist())],
+        index=series.index
+    )
+
+# Function to get the content digest of an upload, hashed once per upload rather than every rerun
+def file_digest(file):
+    digests = st.session_state.setdefault('file_digests', {})
+    if file.file_id not in digests:
+        digests[file.file_id] = hashlib.sha1(file.getbuffer()).hexdigest()
+    return digests[file.file_id]
+
+# Function to keep only the most recently used Parquet files in the cache directory
+def prune_parquet_cache():
+    paths = [os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR) if name.endswith('.parquet')]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[MAX_CACHED_FILES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Function to read the first sheet of an uploaded Excel file, cached by content digest
+# in memory and as Parquet on disk so re-uploads of the same workbook skip the Excel parse
+@st.cache_data(show_spinner=False, max_entries=MAX_CACHED_FILES)
+def read_excel_file(name, digest, _data):
+    cache_path = os.path.join(CACHE_DIR, f"{digest}-{PARSE_VERSION}.parquet")
     try:
-        if pd.isna(time_val):
-            return 0
-        if isinstance(time_val, (int, float)):
-            return float(time_val)
-        if isinstance(time_val, str):
-            parts = time_val.split(':')
-            parts = [p.strip() for p in parts]
-            if len(parts) == 3:  # HH:MM:SS
-                h, m, s = map(int, parts)
-                return h * 3600 + m * 60 + s
-            elif len(parts) == 2:  # MM:SS
-                m, s = map(int, parts)
-                return m * 60 + s
-        return 0
-    except:
-        return 0
-
-# Function to format seconds to [h]:mm:ss for display
-def seconds_to_time(seconds):
-    if pd.isna(seconds):
-        return "0:00:00"
-    seconds = int(seconds)
-    hours = seconds // 3600
-    seconds %= 3600
-    minutes = seconds // 60
-    seconds = seconds % 60
-    return f"{hours}:{minutes:02d}:{seconds:02d}"
-
-# Function to merge and aggregate Excel files
-def merge_excel_files(files):
+        df = pd.read_parquet(cache_path)
+        os.utime(cache_path)
+        # Parquet doesn't round-trip the string storage, so re-apply the hints to match a fresh parse
+        return df.astype({col: dtype for col, dtype in COLUMN_DTYPES.items() if col in df.columns})
+    except (OSError, ValueError):
+        pass
+    
+    df = pd.read_excel(BytesIO(_data), engine=READ_ENGINE, dtype=COLUMN_DTYPES,
+                       usecols=lambda col: col not in DROPPED_COLUMNS)
+    
+    # Mixed-type object columns can't always be written as Parquet; those files just aren't cached
+    temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        # List to store DataFrames
-        dfs = []
+        df.to_parquet(temp_path, index=False)
+        os.replace(temp_path, cache_path)
+        prune_parquet_cache()
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    return df
+
+# Function to merge and aggregate Excel files, cached by (name, digest) of each upload;
+# unexpected errors are raised rather than returned so they are never cached
+@st.cache_data(show_spinner=False, max_entries=MAX_CACHED_MERGES)
+def merge_excel_files(file_keys, _files):
+    # Read each Excel file in parallel
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_READ_WORKERS, len(file_keys)))) as executor:
+        dfs = list(executor.map(
+            lambda key, file: read_excel_file(*key, file.getbuffer()),
+            file_keys,
+            _files
+        ))
+    
+    # Concatenate all DataFrames
+    if dfs:
+        merged_df = pd.concat(dfs, ignore_index=True)
         
-        # Read each Excel file
-        for file in files:
-            # Save the file temporarily
-            file_path = os.path.join(UPLOAD_DIR, file.name)
-            with open(file_path, "wb") as f:
-                f.write(file.getbuffer())
+        # Remove rows where Collector Name is blank (NaN, empty string, or whitespace)
+        if 'Collector Name' in merged_df.columns:
+            # Arrow-backed strings (see COLUMN_DTYPES) keep the strip and compare in native code
+            merged_df['Collector Name'] = merged_df['Collector Name'].astype('string[pyarrow]')
+            mask = merged_df['Collector Name'].notna() & merged_df['Collector Name'].str.strip().ne('')
+            merged_df = merged_df.loc[mask]
             
-            # Read the first sheet of the Excel file
-            df = pd.read_excel(file_path, engine=None)
-            dfs.append(df)
+            # Group on integer category codes rather than hashing each name
+            merged_df['Collector Name'] = merged_df['Collector Name'].astype('category')
+        else:
+            return None, "Collector Name column not found in the data."
         
-        # Concatenate all DataFrames
-        if dfs:
-            merged_df = pd.concat(dfs, ignore_index=True)
-            
-            # Remove SNo., Total Calls, and Pause Count columns if they exist
-            columns_to_drop = ['SNo.', 'Total Calls', 'Pause Count']
-            merged_df = merged_df.drop(columns=[col for col in columns_to_drop if col in merged_df.columns])
-                
-            # Remove rows where Collector Name is blank (NaN, empty string, or whitespace)
-            if 'Collector Name' in merged_df.columns:
-                merged_df = merged_df[merged_df['Collector Name'].notna() & (merged_df['Collector Name'].str.strip() != '')]
-            else:
-                return None, "Collector Name column not found in the data."
-            
-            # Define time columns to convert and sum
-            time_columns = [
-                'Spent Time', 'Talk Time', 'AVG Talk Time', 'Wait Time',
-                'Average Wait Time', 'Write Time', 'AVG Write Time', 'Pause Time'
-            ]
-            
-            # Filter time columns to those present in the DataFrame
-            valid_time_columns = [col for col in time_columns if col in merged_df.columns]
-            
-            # Convert time columns to seconds for aggregation
-            for col in valid_time_columns:
-                merged_df[col] = merged_df[col].apply(time_to_seconds)
-            
-            # Group by Collector Name and aggregate
-            agg_dict = {}
-            for col in valid_time_columns:
-                agg_dict[col] = 'sum'
-            other_columns = [col for col in merged_df.columns if col not in valid_time_columns + ['Collector Name']]
-            for col in other_columns:
-                agg_dict[col] = 'first'
-            
-            if not agg_dict:
-                return merged_df, None
-            
-            merged_df = merged_df.groupby('Collector Name').agg(agg_dict).reset_index()
-            
-            # Calculate averages for time columns
-            avg_row = {'Collector Name': 'Average'}
-            for col in valid_time_columns:
-                avg_row[col] = merged_df[col].mean()
-            for col in other_columns:
-                avg_row[col] = None
-            
-            # Append average row to DataFrame
-            avg_df = pd.DataFrame([avg_row])
-            merged_df = pd.concat([merged_df, avg_df], ignore_index=True)
-            
+        # Filter time columns to those present in the DataFrame
+        valid_time_columns = [col for col in TIME_COLUMNS if col in merged_df.columns]
+        
+        # Convert time columns to timedeltas so the groupby sums them natively
+        for col in valid_time_columns:
+            merged_df[col] = pd.to_timedelta(time_to_seconds(merged_df[col]), unit='s')
+        
+        # Group by Collector Name: sum the time columns, keep the first row's value of the rest
+        other_columns = [col for col in merged_df.columns if col not in valid_time_columns + ['Collector Name']]
+        
+        if not valid_time_columns and not other_columns:
             return merged_df, None
-        else:
-            return None, "No valid Excel files uploaded."
-            
-    except Exception as e:
-        return None, f"Error merging files: {str(e)}"
+        
+        sums = merged_df.groupby('Collector Name', sort=False, observed=True)[valid_time_columns].sum()
+        firsts = merged_df.drop_duplicates('Collector Name', keep='first').set_index('Collector Name')[other_columns]
+        merged_df = sums.join(firsts).reset_index()
+        merged_df['Collector Name'] = merged_df['Collector Name'].astype('string[pyarrow]')
+        
+        # Append an average row for the time columns; other columns are left blank
+        averages = merged_df[valid_time_columns].mean()
+        merged_df.loc[len(merged_df), ['Collector Name'] + valid_time_columns] = ['Average', *averages]
+        
+        return merged_df, None
+    else:
+        return None, "No valid Excel files uploaded."
 
 # Process uploaded files
 if uploaded_files:
     st.success(f"Successfully uploaded {len(uploaded_files)} file(s)!")
     
-    # Merge files
-    merged_df, error = merge_excel_files(uploaded_files)
+    # Merge files, keyed on content so reruns with the same uploads hit the cache
+    file_keys = tuple((file.name, file_digest(file)) for file in uploaded_files)
+    try:
+        merged_df, error = merge_excel_files(file_keys, uploaded_files)
+    except Exception as e:
+        merged_df, error = None, f"Error merging files: {str(e)}"
     
     if error:
         st.error(error)
     else:
         # Display preview of merged data
         st.write("**Preview of Merged Data**")
-        display_df = merged_df.copy()
-        time_columns = [
-            'Spent Time', 'Talk Time', 'AVG Talk Time', 'Wait Time',
-            'Average Wait Time', 'Write Time', 'AVG Write Time', 'Pause Time'
-        ]
-        valid_time_columns = [col for col in time_columns if col in display_df.columns]
-        for col in valid_time_columns:
-            display_df[col] = display_df[col].apply(seconds_to_time)
+        valid_time_columns = [col for col in TIME_COLUMNS if col in merged_df.columns]
         
-        preview_text = display_df.to_string(index=False)
-        st.text_area(
-            "Merged Data Preview",
-            preview_text,
-            height=200,
-            key=f"preview_merged_{hash(str(uploaded_files))}"
-        )
+        # Only the time columns are rebuilt; the rest are shared with merged_df
+        display_df = pd.DataFrame({
+            col: seconds_to_time(merged_df[col].dt.total_seconds()) if col in valid_time_columns else merged_df[col]
+            for col in merged_df.columns
+        }, copy=False)
+        
+        st.dataframe(display_df, use_container_width=True, hide_index=True)
         
         # Prepare download for merged data
         output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            excel_df = merged_df.copy()
-            for col in valid_time_columns:
-                excel_df[col] = excel_df[col] / 86400.0
+        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+            excel_df = pd.DataFrame({
+                col: merged_df[col].dt.total_seconds() / 86400.0 if col in valid_time_columns else merged_df[col]
+                for col in merged_df.columns
+            }, copy=False)
             
-            excel_df.to_excel(writer, index=False, sheet_name='Sheet1')
+            # Data only; headers are written below in the same pass as the column formats
+            excel_df.to_excel(writer, index=False, header=False, startrow=1, sheet_name='Sheet1')
             workbook = writer.book
             worksheet = writer.sheets['Sheet1']
             
-            for col in valid_time_columns:
-                col_idx = merged_df.columns.get_loc(col) + 1
-                col_letter = get_column_letter(col_idx)
-                for row in range(2, len(merged_df) + 2):
-                    cell = worksheet[f"{col_letter}{row}"]
-                    cell.number_format = '[h]:mm:ss'
-                    cell.alignment = Alignment(horizontal='right')
-                
-                header_cell = worksheet[f"{col_letter}1"]
-                header_cell.alignment = Alignment(horizontal='right')
+            # Header formats match pandas' default header; only alignment differs
+            name_header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+            header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'right', 'valign': 'top'})
+            right_format = workbook.add_format({'align': 'right'})
+            time_format = workbook.add_format({'align': 'right', 'num_format': '[h]:mm:ss'})
             
-            for col_idx in range(1, len(merged_df.columns) + 1):
-                col_name = merged_df.columns[col_idx - 1]
-                if col_name != 'Collector Name':
-                    col_letter = get_column_letter(col_idx)
-                    for row in range(1, len(merged_df) + 2):
-                        cell = worksheet[f"{col_letter}{row}"]
-                        if col_name not in valid_time_columns:
-                            cell.alignment = Alignment(horizontal='right')
+            for col_idx, col_name in enumerate(merged_df.columns):
+                if col_name == 'Collector Name':
+                    worksheet.write(0, col_idx, col_name, name_header_format)
+                    continue
+                col_format = time_format if col_name in valid_time_columns else right_format
+                worksheet.set_column(col_idx, col_idx, None, col_format)
+                worksheet.write(0, col_idx, col_name, header_format)
         
         output.seek(0)
         